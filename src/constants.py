@@ -84,6 +84,27 @@ MODEL_LAYERS = {f"bert-{SIZE_BASE}-{LANGUAGE_MULTILINGUAL}-{CASING_CASED}": 12,
 
 BERT_MODEL_DIR = "/net/projects/bert/models/"
 
+# Transformer inference dtype policy used when a GPU is available, 'mixed_float16' uses tensor cores,
+# set to None for float32 inference. On CPU float32 is always used, half precision is slow there
+INFERENCE_PRECISION_POLICY = 'mixed_float16'
+
 # data pipeline options
 BUFFER_SIZE = 50 * 1000 * 1000
 SHUFFLE_SIZE = 512
+# number of serialized examples parsed at once when reading tfrecord files
+DECODE_BATCH_SIZE = 64
+# sentences are batched by the number of wordpieces, for lengths in [0, 16), [16, 32), [32, 64), [64, MAX_WORDPIECES)
+# batch sizes are chosen to keep the number of wordpieces passed through the Transformer at once similar
+EMBEDDING_BUCKET_BOUNDARIES = [16, 32, 64]
+EMBEDDING_BUCKET_BATCH_SIZES = [128, 64, 32, 16]
+# compression of the saved tfrecord files, the lowest level is the fastest
+TFRECORD_COMPRESSION_TYPE = 'GZIP'
+TFRECORD_COMPRESSION_LEVEL = 1
+# number of computed batches waiting to be written to a tfrecord file
+WRITER_QUEUE_SIZE = 4
+# each tfrecord file is split into shards written in parallel, and read back with parallel reads,
+# the number is fixed, so that the order of records doesn't depend on the machine
+TFRECORD_SHARDS = 8
+# indices of layers saved in tfrecord files (0 is the first transformer layer), None saves all the layers,
+# saving only the probed layers reduces the size of the files, but layer averaging (layer index -1) needs all of them
+PROBED_LAYERS = None
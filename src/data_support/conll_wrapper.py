@@ -1,5 +1,4 @@
 import numpy as np
-import tensorflow as tf
 from collections import defaultdict
 import networkx as nx
 
@@ -11,8 +10,10 @@ RANDOM_SEED = 2019
 class ConllWrapper():
 
     max_wordpieces = None
+    # whether tokens in each sentence are shuffled before computing wordpieces
+    shuffle_tokens = False
 
-    def __init__(self, conll_file, bert_tokenizer):
+    def __init__(self, conll_file, bert_tokenizer, base=None):
 
         self.conllu_name = conll_file
         self.tokenizer = bert_tokenizer
@@ -25,9 +26,30 @@ class ConllWrapper():
         self.roots = []
         self.coreferences = []
         self.shuffled = []
-
-        self.read_conllu(conll_file)
-        self.training_examples()  # this call is needed here, because it removes too long and mismatched sentences
+        # tokenized sentences for each value of the `shuffle` argument
+        self._encodings = dict()
+
+        if base is not None:
+            self._copy_from(base)
+        else:
+            self.read_conllu(conll_file)
+        self.encode(self.shuffle_tokens)  # this call is needed here, because it removes too long sentences
+
+    @classmethod
+    def from_base(cls, base, lang='en'):
+        """ Creates wrapper for a specific task reusing sentences already read and tokenized by the `base` wrapper
+        (for the same conllu file and tokenizer)."""
+        return cls(base.conllu_name, base.tokenizer, lang=lang, base=base)
+
+    def _copy_from(self, base):
+        self.tokens = list(base.tokens)
+        self.lemmas = list(base.lemmas)
+        self.pos = list(base.pos)
+        self.relations = list(base.relations)
+        self.roots = list(base.roots)
+        self.coreferences = list(base.coreferences)
+        self.shuffled = list(base.shuffled)
+        self._encodings = dict(base._encodings)
 
     @property
     def punctuation_mask(self):
@@ -97,47 +119,42 @@ class ConllWrapper():
                         sentence_lemmas.append(fields[constants.CONLLU_LEMMA])
                         sentence_pos.append(fields[constants.CONLLU_POS])
 
-    def get_bert_ids(self, wordpieces):
-        """Token ids from Tokenizer vocab"""
-        token_ids = self.tokenizer.convert_tokens_to_ids(wordpieces)
-        input_ids = token_ids + [0] * (constants.MAX_WORDPIECES - len(wordpieces))
-        return input_ids
-
-    def training_examples(self, shuffle=False):
+    def encode(self, shuffle=False):
         '''
-        Joins wordpices of tokens, so that they correspond to the tokens in conllu file.
+        Tokenizes all the sentences at once and removes sentences that are too long.
         :param shuffle: whether to shuffle tokens in each sentence
-        
+
         :return:
-            2-D tensor  [num valid sentences, max num wordpieces] bert wordpiece ids,
-            2-D tensor [num valid sentences, max num wordpieces] wordpiece to word segment mappings
-            1-D tensor [num valid sentences] number of words in each sentence
+            list of tuples for each valid sentence: wordpiece ids, wordpiece to word mapping (None for special tokens),
+            number of words
         '''
-        
-        number_examples = len(self.tokens)
-        wordpieces = []
-        indices_to_rm = []
-        
-        for idx, sent_tokens in enumerate(self.tokens[:]):
-            if shuffle:
+        if shuffle in self._encodings:
+            return self._encodings[shuffle]
+
+        if shuffle and not self.shuffled:
+            # permutations are drawn once, so that repeated calls return the same examples
+            for sent_tokens in self.tokens:
                 sent_shuf = np.arange(len(sent_tokens))
                 self.random_state.shuffle(sent_shuf)
                 self.shuffled.append(sent_shuf)
-                
-                sent_tokens = list(np.array(sent_tokens)[sent_shuf])
-                
-            sent_wordpieces = [self.tokenizer.cls_token] + self.tokenizer.tokenize((' '.join(sent_tokens))) + [self.tokenizer.sep_token]
 
+        if shuffle:
+            sentences = [list(np.array(sent_tokens)[sent_shuf])
+                         for sent_tokens, sent_shuf in zip(self.tokens, self.shuffled)]
+        else:
+            sentences = self.tokens
+
+        # single call to the fast (Rust) tokenizer for all the sentences in the file
+        encodings = self.tokenizer(sentences, is_split_into_words=True, add_special_tokens=True)
+
+        indices_to_rm = []
+        for idx, (sent_tokens, sent_ids) in enumerate(zip(sentences, encodings['input_ids'])):
             if len(sent_tokens) >= constants.MAX_TOKENS:
                 print(f"Sentence {idx} too many tokens, in file {self.conllu_name}, skipping.")
                 indices_to_rm.append(idx)
-                number_examples -= 1
-            elif len(sent_wordpieces) >= constants.MAX_WORDPIECES:
+            elif len(sent_ids) >= constants.MAX_WORDPIECES:
                 print(f"Sentence {idx} too many wordpieces, in file {self.conllu_name}, skipping.")
                 indices_to_rm.append(idx)
-                number_examples -= 1
-
-            wordpieces.append(sent_wordpieces)
 
         if self.coreferences:
             for idx, sent_corefernces in enumerate(self.coreferences):
@@ -145,38 +162,34 @@ class ConllWrapper():
                     print(f"Sentence pair {idx} less then two coreferents, in file {self.conllu_name}, skipping.")
                     indices_to_rm.append(idx)
 
-        segments = []
-        max_segment = []
-        bert_ids = []
-        sent_idx = 0
-        for sent_wordpieces, sent_tokens in zip(wordpieces, self.tokens[:]):
-            if sent_idx in indices_to_rm:
-                sent_idx += 1
-                continue
-
-            sent_segments = np.zeros((constants.MAX_WORDPIECES,), dtype=np.int64) - 1
-            segment_id = 0
-            wordpiece_pointer = 1
-            if shuffle:
-                sent_shuf = self.shuffled[sent_idx]
-                sent_tokens = list(np.array(sent_tokens)[sent_shuf])
-            for token in sent_tokens:
-                worpieces_per_token = len(self.tokenizer.tokenize(token))
-                sent_segments[wordpiece_pointer:wordpiece_pointer+worpieces_per_token] = segment_id
-                wordpiece_pointer += worpieces_per_token
-                segment_id += 1
-
-            if wordpiece_pointer+1 != len(sent_wordpieces):
-                print(f'Sentence {sent_idx} mismatch in number of tokens, in file {self.conllu_name}, skipping.')
-                indices_to_rm.append(sent_idx)
-            else:
-                segments.append(tf.constant(sent_segments, dtype=tf.int64))
-                bert_ids.append(tf.constant(self.get_bert_ids(sent_wordpieces), dtype=tf.int64))
-                max_segment.append(segment_id)
-            sent_idx += 1
+        self._encodings[shuffle] = [(sent_ids, encodings.word_ids(sent_idx), len(sent_tokens))
+                                    for sent_idx, (sent_tokens, sent_ids)
+                                    in enumerate(zip(sentences, encodings['input_ids']))
+                                    if sent_idx not in indices_to_rm]
         self.remove_indices(indices_to_rm)
+        return self._encodings[shuffle]
+
+    def training_examples(self, shuffle=None):
+        '''
+        Joins wordpices of tokens, so that they correspond to the tokens in conllu file.
+        Examples are generated one by one, so that the whole dataset doesn't need to be kept in memory.
+        Examples are not padded, padding is left to batching.
+        :param shuffle: whether to shuffle tokens in each sentence, by default `shuffle_tokens` of the class
+        
+        :return:
+            generator of tuples for each valid sentence:
+            1-D array [num wordpieces] bert wordpiece ids,
+            1-D array [num wordpieces] wordpiece to word segment mappings (-1 for special tokens)
+            number of words in the sentence
+        '''
+        if shuffle is None:
+            shuffle = self.shuffle_tokens
+
+        for sent_ids, sent_word_ids, sent_len in self.encode(shuffle):
+            # special tokens are not mapped to any word
+            sent_segments = np.array([-1 if word_id is None else word_id for word_id in sent_word_ids], dtype=np.int64)
 
-        return tf.stack(bert_ids), tf.stack(segments), tf.constant(max_segment, dtype=tf.int64)
+            yield np.array(sent_ids, dtype=np.int64), sent_segments, sent_len
 
     def generate_random_tree(self, sentence_length):
 
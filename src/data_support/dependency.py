@@ -9,8 +9,8 @@ class DependencyDistance(ConllWrapper):
 
     max_wordpieces = constants.MAX_WORDPIECES
 
-    def __init__(self, conll_file, bert_tokenizer, lang='en'):
-        super().__init__(conll_file, bert_tokenizer)
+    def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+        super().__init__(conll_file, bert_tokenizer, base=base)
 
     def target_and_mask(self):
         """Computes the distances between all pairs of words; returns them as a tensor.
@@ -87,8 +87,8 @@ class DependencyDistance(ConllWrapper):
 
 class DependencyDepth(ConllWrapper):
 
-    def __init__(self, conll_file, bert_tokenizer, lang='en'):
-        super().__init__(conll_file, bert_tokenizer)
+    def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+        super().__init__(conll_file, bert_tokenizer, base=base)
 
     def target_and_mask(self):
         """Computes the depth of each word; returns them as a tensor.
@@ -9,8 +9,8 @@ import constants
 
 class LexicalDistance(ConllWrapper):
 
-    def __init__(self, conll_file, bert_tokenizer, lang='en'):
-        super().__init__(conll_file, bert_tokenizer)
+    def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+        super().__init__(conll_file, bert_tokenizer, base=base)
         if lang not in constants.lang2iso:
             raise ValueError(f'Language {lang} is not supported by Open Multilingual Wordnet')
         self.iso_lang = constants.lang2iso[lang]
@@ -88,8 +88,8 @@ class LexicalDistance(ConllWrapper):
 
 class LexicalDepth(ConllWrapper):
 
-    def __init__(self, conll_file, bert_tokenizer, lang='en'):
-        super().__init__(conll_file, bert_tokenizer)
+    def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+        super().__init__(conll_file, bert_tokenizer, base=base)
         if lang not in constants.lang2iso:
             raise ValueError(f'Language {lang} is not supported by Open Multilingual Wordnet')
         self.iso_lang = constants.lang2iso[lang]
@@ -7,8 +7,8 @@ from data_support.conll_wrapper import ConllWrapper
 
 class PositionalDistance(ConllWrapper):
 
-	def __init__(self, conll_file, bert_tokenizer, lang='en'):
-		super().__init__(conll_file, bert_tokenizer)
+	def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+		super().__init__(conll_file, bert_tokenizer, base=base)
 
 	def target_and_mask(self):
 		"""Computes the distances between all pairs of words; returns them as a tensor.
@@ -40,8 +40,8 @@ class PositionalDistance(ConllWrapper):
 
 class PositionalDepth(ConllWrapper):
 
-	def __init__(self, conll_file, bert_tokenizer, lang='en'):
-		super().__init__(conll_file, bert_tokenizer)
+	def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+		super().__init__(conll_file, bert_tokenizer, base=base)
 
 	def target_and_mask(self):
 		"""Computes the depth of each word; returns them as a tensor.
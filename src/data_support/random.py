@@ -8,8 +8,8 @@ from data_support.dependency import DependencyDistance, DependencyDepth
 class RandomDistance(DependencyDistance):
 
 
-	def __init__(self, conll_file, bert_tokenizer, lang='en'):
-		super().__init__(conll_file, bert_tokenizer)
+	def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+		super().__init__(conll_file, bert_tokenizer, base=base)
 
 
 	def target_and_mask(self):
@@ -43,8 +43,8 @@ class RandomDistance(DependencyDistance):
 
 class RandomDepth(DependencyDepth):
 
-	def __init__(self, conll_file, bert_tokenizer, lang='en'):
-		super().__init__(conll_file, bert_tokenizer)
+	def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+		super().__init__(conll_file, bert_tokenizer, base=base)
 
 	def target_and_mask(self):
 		"""Computes the depth of each word; returns them as a tensor.
@@ -7,8 +7,10 @@ from data_support.conll_wrapper import ConllWrapper
 
 class ShuffledDistance(ConllWrapper):
 
-	def __init__(self, conll_file, bert_tokenizer, lang='en'):
-		super().__init__(conll_file, bert_tokenizer)
+	shuffle_tokens = True
+
+	def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+		super().__init__(conll_file, bert_tokenizer, base=base)
 
 	def target_and_mask(self):
 		"""Computes the distances between all pairs of words; returns them as a tensor.
@@ -39,14 +41,13 @@ class ShuffledDistance(ConllWrapper):
 
 			yield tf.constant(sentence_distances, dtype=tf.float32), sentence_mask
 
-	def training_examples(self, shuffle=True):
-		return super().training_examples(shuffle)
-
 
 class ShuffledDepth(ConllWrapper):
 
-	def __init__(self, conll_file, bert_tokenizer, lang='en'):
-		super().__init__(conll_file, bert_tokenizer)
+	shuffle_tokens = True
+
+	def __init__(self, conll_file, bert_tokenizer, lang='en', base=None):
+		super().__init__(conll_file, bert_tokenizer, base=base)
 
 	def target_and_mask(self):
 		"""Computes the depth of each word; returns them as a tensor.
@@ -67,5 +68,3 @@ class ShuffledDepth(ConllWrapper):
 
 			yield tf.constant(sentence_depths, dtype=tf.float32), sentence_mask
 			
-	def training_examples(self, shuffle=True):
-		return super().training_examples(shuffle)
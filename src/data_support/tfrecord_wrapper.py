@@ -1,16 +1,21 @@
 import tensorflow as tf
+import numpy as np
 from tqdm import tqdm
 import os
 import json
-from collections import defaultdict, Mapping
+import queue
+import threading
+from collections import defaultdict
 from itertools import chain
-from copy import deepcopy
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
-from transformers import BertTokenizer, BertConfig, TFBertModel
-from transformers import RobertaTokenizer, TFRobertaModel
-from transformers import XLMRobertaTokenizer, TFXLMRobertaModel
+from transformers import BertTokenizerFast, BertConfig, TFBertModel
+from transformers import RobertaTokenizerFast, TFRobertaModel
+from transformers import XLMRobertaTokenizerFast, TFXLMRobertaModel
 
 import constants
+from data_support.conll_wrapper import ConllWrapper
 from data_support.dependency import DependencyDistance, DependencyDepth
 from data_support.lexical import LexicalDistance, LexicalDepth
 from data_support.random import RandomDistance, RandomDepth
@@ -37,16 +42,19 @@ conllu_wrappers = {
 def merge_dict(d1, d2):
     """
     Modifies d1 in-place to contain values from d2.  If any value
-    in d1 is a dictionary (or dict-like), *and* the corresponding
+    in d1 is a dictionary, *and* the corresponding
     value in d2 is also a dictionary, then merge them in-place.
+    Nested dictionaries are merged iteratively with an explicit stack.
     """
-    for k,v2 in d2.items():
-        v1 = d1.get(k) # returns None if v1 has no value for this key
-        if ( isinstance(v1, Mapping) and
-             isinstance(v2, Mapping) ):
-            merge_dict(v1, v2)
-        else:
-            d1[k] = v2
+    stack = [(d1, d2)]
+    while stack:
+        a, b = stack.pop()
+        for k, v2 in b.items():
+            v1 = a.get(k) # returns None if v1 has no value for this key
+            if isinstance(v1, dict) and isinstance(v2, dict):
+                stack.append((v1, v2))
+            else:
+                a[k] = v2
 
 class TFRecordWrapper:
 
@@ -58,17 +66,20 @@ class TFRecordWrapper:
         self.models = models
         self.languages = list(set(languages))
 
-        self.map_tfrecord = dict()
-        for mode in self.modes:
-            self.map_tfrecord[mode] = dict()
-            for model in models:
-                self.map_tfrecord[mode][model] = dict()
-                for lang in languages:
-                    self.map_tfrecord[mode][model][lang] = dict()
-                    for task in tasks:
-                        self.map_tfrecord[mode][model][lang][task] = None
+        self.map_tfrecord = self._empty_map(tasks, models, languages)
+        self.map_conll = self._empty_map(tasks, models, languages)
+        # compression type of each tfrecord file, files missing in the map are not compressed
+        self.map_compression = dict()
+        # shards of each tfrecord file, files missing in the map are saved in a single file
+        self.map_shards = dict()
+        # layers saved in each tfrecord file, files missing in the map contain all the layers
+        self.map_layers = dict()
 
-        self.map_conll = deepcopy(self.map_tfrecord)
+    @classmethod
+    def _empty_map(cls, tasks, models, languages):
+        """ Nested dictionary mode -> model -> language -> task with None values."""
+        return {mode: {model: {lang: {task: None for task in tasks} for lang in languages} for model in models}
+                for mode in cls.modes}
 
     def _from_json(self, data_dir):
         with open(os.path.join(data_dir,self.data_map_fn),'r') as in_json:
@@ -81,13 +92,25 @@ class TFRecordWrapper:
                 merge_dict(self.map_tfrecord, value)
             elif attribute == "map_conll":
                 merge_dict(self.map_conll, value)
+            elif attribute == "map_compression":
+                self.map_compression.update(value)
+            elif attribute == "map_shards":
+                self.map_shards.update(value)
+            elif attribute == "map_layers":
+                self.map_layers.update(value)
+
+    def tfrecord_shards(self, tfrecord_file):
+        return self.map_shards.get(tfrecord_file, [tfrecord_file])
 
     def _to_json(self, data_dir):
         out_dict = {"tasks": self.tasks,
                     "models": self.models,
                     "languages": self.languages,
                     "map_conll": self.map_conll,
-                    "map_tfrecord": self.map_tfrecord}
+                    "map_tfrecord": self.map_tfrecord,
+                    "map_compression": self.map_compression,
+                    "map_shards": self.map_shards,
+                    "map_layers": self.map_layers}
 
         with open(os.path.join(data_dir,self.data_map_fn), 'w') as out_json:
             json.dump(out_dict, out_json, indent=2, sort_keys=True)
@@ -149,30 +172,115 @@ class TFRecordWriter(TFRecordWrapper):
         for model_path in self.models:
             # This is crude, but should work
             do_lower_case = "uncased" in model_path
-            model, tokenizer = self.get_model_tokenizer(model_path, do_lower_case=do_lower_case)
+            precision_policy = constants.INFERENCE_PRECISION_POLICY if tf.config.list_physical_devices('GPU') else None
+            model, tokenizer = self.get_model_tokenizer(model_path, do_lower_case=do_lower_case,
+                                                        precision_policy=precision_policy)
+            calc_embeddings = self.embeddings_factory(model, layers=constants.PROBED_LAYERS)
+
+            tfrecord_files = []
             for tfrecord_file in self.model2tfrs[model_path]:
-                if os.path.isfile(os.path.join(data_dir, tfrecord_file)):
+                if all(os.path.isfile(os.path.join(data_dir, shard_file))
+                       for shard_file in self.tfrecord_shards(tfrecord_file)):
                     print(f"File {os.path.join(data_dir, tfrecord_file)} already exists, skipping!")
                     continue
-
-                conll_fn = self.tfr2conll[tfrecord_file]
-                lang = self.tfr2lang[tfrecord_file]
-                tasks = list(self.tfr2tasks[tfrecord_file])
-
-                in_datasets = [conllu_wrappers[task](conll_fn, tokenizer, lang=lang) for task in tasks]
-                all_wordpieces, all_segments, all_token_len = in_datasets[0].training_examples()
-
-                options = tf.io.TFRecordOptions()#compression_type='GZIP')
-                with tf.io.TFRecordWriter(os.path.join(data_dir, tfrecord_file), options=options) as tf_writer:
-                    for idx, (wordpieces, segments, token_len, target_mask) in \
-                            tqdm(enumerate(
-                                zip(tf.unstack(all_wordpieces), tf.unstack(all_segments), tf.unstack(all_token_len),
-                                    self.generate_target_masks(tasks, in_datasets))), desc="Embedding computation"):
-                        embeddings = self.calc_embeddings(model, wordpieces, segments, token_len, constants.MAX_WORDPIECES)
-                        train_example = self.serialize_example(idx, embeddings, token_len, target_mask)
-                        tf_writer.write(train_example.SerializeToString())
+                tfrecord_files.append(tfrecord_file)
+            tfrecord_tasks = {tfrecord_file: list(self.tfr2tasks[tfrecord_file]) for tfrecord_file in tfrecord_files}
+
+            # the next conllu file is read and tokenized in a background thread, while the embeddings are computed
+            # for the current one. Threads are used, because TensorFlow runtime can't be safely forked.
+            # Only one file is read ahead, so that tokenized files don't pile up in memory.
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                def submit_read(tfrecord_file):
+                    return executor.submit(self.read_conll_datasets, self.tfr2conll[tfrecord_file], tokenizer,
+                                           self.tfr2lang[tfrecord_file], tfrecord_tasks[tfrecord_file])
+
+                next_in_datasets = submit_read(tfrecord_files[0]) if tfrecord_files else None
+                for file_idx, tfrecord_file in enumerate(tfrecord_files):
+                    in_datasets = next_in_datasets.result()
+                    next_in_datasets = submit_read(tfrecord_files[file_idx + 1]) \
+                        if file_idx + 1 < len(tfrecord_files) else None
+                    shard_files = [self.struct_shard_fn(tfrecord_file, shard, constants.TFRECORD_SHARDS)
+                                   for shard in range(constants.TFRECORD_SHARDS)]
+                    self.save_tfrecord_file([os.path.join(data_dir, shard_file) for shard_file in shard_files],
+                                            tfrecord_tasks[tfrecord_file], in_datasets, calc_embeddings)
+                    # wrappers of the saved file are released, at most the current and the next file are kept in memory
+                    del in_datasets
+                    self.map_compression[tfrecord_file] = constants.TFRECORD_COMPRESSION_TYPE
+                    self.map_shards[tfrecord_file] = shard_files
+                    self.map_layers[tfrecord_file] = constants.PROBED_LAYERS
+                    # data map is saved after each file, so that saved files are skipped if the run is interrupted
+                    self._to_json(data_dir)
+            # the model is released before the next one is loaded, so that two models are not kept in memory
+            del model, calc_embeddings
         self._to_json(data_dir)
 
+    @staticmethod
+    def read_conll_datasets(conll_fn, tokenizer, lang, tasks):
+        # conllu file is read and tokenized once and shared by the wrappers of all the tasks
+        base_dataset = ConllWrapper(conll_fn, tokenizer)
+        return [conllu_wrappers[task].from_base(base_dataset, lang=lang) for task in tasks]
+
+    def save_tfrecord_file(self, shard_paths, tasks, in_datasets, calc_embeddings):
+        # examples are streamed from conllu wrapper, so that padded examples for the whole file are not kept in memory
+        examples = tf.data.Dataset.from_generator(
+            in_datasets[0].training_examples,
+            output_signature=(tf.TensorSpec((None,), tf.int64),
+                              tf.TensorSpec((None,), tf.int64),
+                              tf.TensorSpec((), tf.int64)))
+
+        # targets are generated in tf.data background thread, so that it overlaps with embedding computation
+        target_masks = tf.data.Dataset.from_generator(partial(self.generate_target_masks, tasks, in_datasets),
+                                                      output_signature=self.target_mask_signature(tasks))
+
+        # index is kept with the example, because bucketing changes the order of sentences
+        data = tf.data.Dataset.zip((examples.enumerate(), target_masks))
+        data = data.map(lambda indexed_example, target_mask: (indexed_example[0], *indexed_example[1], target_mask))
+        # sentences of similar length are batched together and padded only to the longest one in the batch,
+        # so that the computation on padding is minimized
+        data = data.apply(tf.data.experimental.bucket_by_sequence_length(
+            element_length_func=lambda idx, wordpieces, segments, token_len, target_mask: tf.shape(wordpieces)[0],
+            bucket_boundaries=constants.EMBEDDING_BUCKET_BOUNDARIES,
+            bucket_batch_sizes=constants.EMBEDDING_BUCKET_BATCH_SIZES,
+            padding_values=(tf.constant(0, tf.int64), tf.constant(0, tf.int64), tf.constant(-1, tf.int64),
+                            tf.constant(0, tf.int64),
+                            {task: (tf.constant(0.), tf.constant(0.)) for task in tasks})))
+        # attention mask is computed in the input pipeline, instead of each forward pass
+        data = data.map(lambda idx, wordpieces, segments, token_len, target_mask:
+                        (idx, wordpieces, tf.cast(tf.not_equal(wordpieces, 0), tf.int32), segments, token_len,
+                         target_mask),
+                        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        data = data.prefetch(tf.data.experimental.AUTOTUNE)
+
+        options = tf.io.TFRecordOptions(compression_type=constants.TFRECORD_COMPRESSION_TYPE,
+                                        compression_level=constants.TFRECORD_COMPRESSION_LEVEL)
+        # serialization and writing is done in separate threads to not stall the embedding computation,
+        # each thread writes its own shard, so that a single writer doesn't limit the throughput.
+        # Batches are assigned to shards in turn, so that the content of shards is the same when data are regenerated.
+        tf_writers = [tf.io.TFRecordWriter(shard_path, options=options) for shard_path in shard_paths]
+        example_queues = [queue.Queue(maxsize=constants.WRITER_QUEUE_SIZE) for _ in tf_writers]
+        writer_errors = []
+        writer_threads = [threading.Thread(target=self.write_examples, args=(tf_writer, example_queue, writer_errors))
+                          for tf_writer, example_queue in zip(tf_writers, example_queues)]
+        for writer_thread in writer_threads:
+            writer_thread.start()
+        try:
+            for batch_number, (idx, wordpieces, attention_mask, segments, token_len, target_mask) in \
+                    enumerate(tqdm(data, desc="Embedding computation")):
+                embeddings = calc_embeddings(wordpieces, attention_mask, segments)
+                target_mask = {task: (target.numpy(), mask.numpy())
+                               for task, (target, mask) in target_mask.items()}
+                example_queues[batch_number % len(example_queues)].put(
+                    (idx.numpy(), embeddings.numpy(), token_len.numpy(), target_mask))
+        finally:
+            for example_queue in example_queues:
+                example_queue.put(None)
+            for writer_thread in writer_threads:
+                writer_thread.join()
+            for tf_writer in tf_writers:
+                tf_writer.close()
+        if writer_errors:
+            raise writer_errors[0]
+
     @staticmethod
     def struct_tfrecord_fn(model,fn_task,lang,conll_fn):
         conll_base = os.path.basename(conll_fn)
@@ -180,41 +288,75 @@ class TFRecordWriter(TFRecordWrapper):
         return f"{model}_{lang}_{fn_task}_{conll_name}.tfrecord"
 
     @staticmethod
-    def get_model_tokenizer(model_path, do_lower_case, seed=42):
-        if model_path.startswith('bert'):
-            tokenizer = BertTokenizer.from_pretrained(model_path, do_lower_case=do_lower_case)
-            model = TFBertModel.from_pretrained(model_path, output_hidden_states=True, output_attentions=False)
-        elif model_path.startswith('roberta'):
-            tokenizer = RobertaTokenizer.from_pretrained(model_path, do_lower_case=do_lower_case, add_prefix_space=True)
-            model = TFRobertaModel.from_pretrained(model_path, output_hidden_states=True, output_attentions=False)
-        elif model_path.startswith('jplu/tf-xlm-roberta'):
-            tokenizer = XLMRobertaTokenizer.from_pretrained(model_path, do_lower_case=do_lower_case)
-            model = TFXLMRobertaModel.from_pretrained(model_path, output_hidden_states=True, output_attentions=False)
-        elif model_path.startswith('random-bert'):
-            tokenizer = BertTokenizer.from_pretrained("bert-base-cased", do_lower_case=True)
-            config = BertConfig(seed=seed, output_hidden_states=True, output_attentions=False)
-            model = TFBertModel(config)
-        else:
-            raise ValueError(f"Unknown Transformer name: {model_path}. "
-                             f"Please select one of the supported models: {constants.SUPPORTED_MODELS}")
-        
-        return model, tokenizer
+    def struct_shard_fn(tfrecord_fn, shard, num_shards):
+        tfrecord_name, tfrecord_ext = os.path.splitext(tfrecord_fn)
+        return f"{tfrecord_name}-{shard:05d}-of-{num_shards:05d}{tfrecord_ext}"
 
     @staticmethod
-    def calc_embeddings(model, wordpieces, segments, token_len, max_wordpieces):
-        wordpieces = tf.expand_dims(wordpieces, 0)
-        segments = tf.expand_dims(segments, 0)
-        max_token_len = tf.constant(token_len, shape=(1,), dtype=tf.int64)
+    def get_model_tokenizer(model_path, do_lower_case, seed=42, precision_policy=None):
+        # Keras layers read the dtype policy when constructed, so the global policy is restored afterwards
+        global_policy = tf.keras.mixed_precision.global_policy()
+        if precision_policy:
+            tf.keras.mixed_precision.set_global_policy(precision_policy)
+        try:
+            if model_path.startswith('bert'):
+                tokenizer = BertTokenizerFast.from_pretrained(model_path, do_lower_case=do_lower_case)
+                model = TFBertModel.from_pretrained(model_path, output_hidden_states=True, output_attentions=False)
+            elif model_path.startswith('roberta'):
+                tokenizer = RobertaTokenizerFast.from_pretrained(model_path, do_lower_case=do_lower_case, add_prefix_space=True)
+                model = TFRobertaModel.from_pretrained(model_path, output_hidden_states=True, output_attentions=False)
+            elif model_path.startswith('jplu/tf-xlm-roberta'):
+                tokenizer = XLMRobertaTokenizerFast.from_pretrained(model_path, do_lower_case=do_lower_case)
+                model = TFXLMRobertaModel.from_pretrained(model_path, output_hidden_states=True, output_attentions=False)
+            elif model_path.startswith('random-bert'):
+                tokenizer = BertTokenizerFast.from_pretrained("bert-base-cased", do_lower_case=True)
+                config = BertConfig(seed=seed, output_hidden_states=True, output_attentions=False)
+                model = TFBertModel(config)
+            else:
+                raise ValueError(f"Unknown Transformer name: {model_path}. "
+                                 f"Please select one of the supported models: {constants.SUPPORTED_MODELS}")
+        finally:
+            tf.keras.mixed_precision.set_global_policy(global_policy)
 
-        model_output = model(wordpieces, attention_mask=tf.sign(wordpieces), training=False)
-        embeddings = model_output.hidden_states[1:]
+        return model, tokenizer
+
+    @staticmethod
+    def calc_embeddings(model, wordpieces, attention_mask, segments, layers=None):
+        # dimensions have the dtype of segments, so that they can be combined with segment ids
+        batch_size = tf.shape(wordpieces, out_type=segments.dtype)[0]
+        max_wordpieces = tf.shape(wordpieces, out_type=segments.dtype)[1]
+
+        model_output = model(wordpieces, attention_mask=attention_mask, training=False)
+        # the first hidden state is the output of embedding layer
+        hidden_states = model_output.hidden_states[1:]
+        if layers is not None:
+            hidden_states = [hidden_states[layer] for layer in layers]
+        # shape [batch, layers, wordpieces, emb_dim], cast to float32 in case of mixed precision inference
+        embeddings = tf.cast(tf.stack(hidden_states, axis=1), tf.float32)
+        num_layers = tf.shape(embeddings, out_type=segments.dtype)[1]
 
         # average wordpieces to obtain word representation
-        # cut to max nummber of words in batch, note that batch.max_token_len is a tensor, bu all the values are the same
-        embeddings = [tf.map_fn(lambda x: tf.math.unsorted_segment_mean(x[0], x[1], x[2]),
-                                (emb, segments, max_token_len), dtype=tf.float32) for emb in embeddings]
-        embeddings = [tf.pad(tf.squeeze(emb, axis=[0]), [[0, max_wordpieces - token_len], [0, 0]]) for emb in embeddings]
-        return embeddings
+        # segments are offset by sentence and layer position, so that all layers of the batch are averaged in one call,
+        # negative segments (special tokens and padding) are left negative to be dropped by the segment mean
+        segments = tf.broadcast_to(tf.expand_dims(segments, 1), [batch_size, num_layers, max_wordpieces])
+        offsets = tf.reshape(tf.range(batch_size * num_layers, dtype=segments.dtype) * max_wordpieces,
+                             [batch_size, num_layers, 1])
+        segments = tf.where(segments >= 0, segments + offsets, tf.constant(-1, dtype=segments.dtype))
+        num_segments = batch_size * num_layers * max_wordpieces
+        # words beyond the sentence length get zero vectors, i.e. the output is padded to wordpieces length
+        embeddings = tf.math.unsorted_segment_mean(embeddings, segments, num_segments)
+        return tf.reshape(embeddings, [batch_size, num_layers, max_wordpieces, -1])
+
+    @staticmethod
+    def embeddings_factory(model, layers=None):
+        # dimensions are left unspecified, so that a single graph is traced for all batch sizes and lengths
+        @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int64),
+                                      tf.TensorSpec([None, None], tf.int32),
+                                      tf.TensorSpec([None, None], tf.int64)])
+        def calc_embeddings(wordpieces, attention_mask, segments):
+            return TFRecordWriter.calc_embeddings(model, wordpieces, attention_mask, segments, layers=layers)
+
+        return calc_embeddings
 
     @staticmethod
     def _int64_feature(value):
@@ -228,19 +370,59 @@ class TFRecordWriter(TFRecordWrapper):
             value = value.numpy()
         return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
 
+    @staticmethod
+    def _array_feature(array, dtype):
+        """Returns a bytes_list with raw bytes of a numpy array, read back with `tf.io.decode_raw`."""
+        return TFRecordWriter._bytes_feature(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
     @staticmethod
     def serialize_example(idx, embeddings, token_len, task_target_mask):
-        feature = {'index': TFRecordWriter._int64_feature(idx),
-                   'num_tokens': TFRecordWriter._int64_feature(token_len)}
-        feature.update({f'layer_{idx}': TFRecordWriter._bytes_feature(tf.io.serialize_tensor(layer_embeddings))
-                        for idx, layer_embeddings in enumerate(embeddings)})
+        feature = {'index': TFRecordWriter._int64_feature(int(idx)),
+                   'num_tokens': TFRecordWriter._int64_feature(int(token_len))}
+        # all the layers are serialized at once, shape [layers, max wordpieces, emb_dim],
+        # embeddings are stored in half precision to reduce the size of the files
+        embeddings = np.pad(embeddings, [[0, 0], [0, constants.MAX_WORDPIECES - embeddings.shape[1]], [0, 0]])
+        feature['all_layers'] = TFRecordWriter._array_feature(embeddings, np.float16)
 
         for task, (target, mask) in task_target_mask.items():
-            feature.update({f'target_{task}': TFRecordWriter._bytes_feature(tf.io.serialize_tensor(target)),
-                            f'mask_{task}': TFRecordWriter._bytes_feature(tf.io.serialize_tensor(mask))})
+            feature.update({f'target_{task}': TFRecordWriter._array_feature(target, np.float32),
+                            f'mask_{task}': TFRecordWriter._array_feature(mask, np.float32)})
 
         return tf.train.Example(features=tf.train.Features(feature=feature))
 
+    @staticmethod
+    def write_examples(tf_writer, example_queue, errors):
+        """ Serializes and writes batches of examples from the queue until None is received.
+        Exceptions are stored in `errors`, the queue is still emptied so that the producer doesn't block."""
+        while True:
+            batch = example_queue.get()
+            if batch is None:
+                break
+            if errors:
+                continue
+            try:
+                indices, embeddings, token_len, target_mask = batch
+                for sent_idx, (idx, sent_embeddings, sent_token_len) in enumerate(zip(indices, embeddings, token_len)):
+                    sent_target_mask = {task: (target[sent_idx], mask[sent_idx])
+                                        for task, (target, mask) in target_mask.items()}
+                    train_example = TFRecordWriter.serialize_example(idx, sent_embeddings,
+                                                                     sent_token_len, sent_target_mask)
+                    tf_writer.write(train_example.SerializeToString())
+            except Exception as e:
+                errors.append(e)
+
+    @staticmethod
+    def target_mask_signature(tasks):
+        """ Shapes and types of targets and masks yielded by `generate_target_masks`."""
+        signature = dict()
+        for task in tasks:
+            if 'distance' in task:
+                shape = (constants.MAX_TOKENS, constants.MAX_TOKENS)
+            else:
+                shape = (constants.MAX_TOKENS,)
+            signature[task] = (tf.TensorSpec(shape, tf.float32), tf.TensorSpec(shape, tf.float32))
+        return signature
+
     @staticmethod
     def generate_target_masks(tasks, in_datasets):
         """ This is basiclly ziping many generators into one, maybe there is simpler solution
@@ -276,10 +458,16 @@ class TFRecordReader(TFRecordWrapper):
                         if task not in self.tasks:
                             raise ValueError(f"Data for this task is not available in the directory: {task}\n"
                                          f" supported tasks: {self.tasks}")
-                        tfr_fn = os.path.join(self.data_dir, self.map_tfrecord[mode][self.model_name][lang][task])
-                        data_set[lang][task] = tf.data.TFRecordDataset(tfr_fn,
-                                                                   #compression_type='GZIP',
-                                                                   buffer_size=constants.BUFFER_SIZE)
+                        tfr_fn = self.map_tfrecord[mode][self.model_name][lang][task]
+                        if self.map_layers.get(tfr_fn) != constants.PROBED_LAYERS:
+                            raise ValueError(f"Layers saved in the file: {tfr_fn} are {self.map_layers.get(tfr_fn)}\n"
+                                             f" but probed layers are {constants.PROBED_LAYERS}")
+                        tfr_paths = [os.path.join(self.data_dir, shard_fn) for shard_fn in self.tfrecord_shards(tfr_fn)]
+                        # all the shards are read in parallel in a fixed order, the buffer is split between them
+                        data_set[lang][task] = tf.data.TFRecordDataset(tfr_paths,
+                                                                   compression_type=self.map_compression.get(tfr_fn, ''),
+                                                                   buffer_size=constants.BUFFER_SIZE // len(tfr_paths),
+                                                                   num_parallel_reads=len(tfr_paths))
 
             self.__setattr__(mode, data_set)
 
@@ -292,15 +480,15 @@ class TFRecordReader(TFRecordWrapper):
 
         def parse(example):
             features_dict = {"num_tokens": tf.io.FixedLenFeature([], tf.int64),
-                             "index": tf.io.FixedLenFeature([], tf.int64)}
-            features_dict.update({f"layer_{idx}": tf.io.FixedLenFeature([], tf.string)
-                                  for idx in range(constants.MODEL_LAYERS[model_name])})
+                             "index": tf.io.FixedLenFeature([], tf.int64),
+                             "all_layers": tf.io.FixedLenFeature([], tf.string)}
             for task in tasks:
                 features_dict.update(
                     {f'target_{task}': tf.io.FixedLenFeature([], tf.string),
                      f'mask_{task}': tf.io.FixedLenFeature([], tf.string)})
 
-            example = tf.io.parse_single_example(example, features_dict)
+            # batch of examples is parsed at once
+            example = tf.io.parse_example(example, features_dict)
 
             return example
 
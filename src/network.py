@@ -144,17 +144,20 @@ class Network():
         def get_projections(self, embeddings, max_token_len, language, task):
             """ Computes projections after Orthogonal Transformation, and after Dimension Scaling"""
             embeddings = embeddings[:, :max_token_len, :]
+            # weights are cast to the precision of embeddings (e.g. bfloat16), projections are returned in float32
             orthogonal_projections = None
             if self.probe.ml_probe:
-                orthogonal_projections = embeddings @ self.probe.LanguageMaps[language]
+                orthogonal_projections = embeddings @ tf.cast(self.probe.LanguageMaps[language], embeddings.dtype)
             if (self.probe._orthogonal_reg and self.probe.ml_probe) or self.probe.with_sv:
-                projections = orthogonal_projections * self.DistanceProbe[task]
+                projections = orthogonal_projections * tf.cast(self.DistanceProbe[task], embeddings.dtype)
             elif self.probe.only_sv:
-                projections = embeddings * self.DistanceProbe[task]
+                projections = embeddings * tf.cast(self.DistanceProbe[task], embeddings.dtype)
             else:
-                projections = embeddings @ self.DistanceProbe[task]
+                projections = embeddings @ tf.cast(self.DistanceProbe[task], embeddings.dtype)
 
-            return orthogonal_projections, projections
+            if orthogonal_projections is not None:
+                orthogonal_projections = tf.cast(orthogonal_projections, tf.float32)
+            return orthogonal_projections, tf.cast(projections, tf.float32)
 
         @tf.function
         def _forward(self, embeddings, max_token_len, language, task, embeddings_gate=None):
@@ -165,7 +168,8 @@ class Network():
             Computes (B(h_i-h_j))^T(B(h_i-h_j)) for all i,j
             """
             if self.probe.average_layers:
-                embeddings = tf.reduce_mean(embeddings * self.probe.LayerWeights[f'lw_{task}'], axis=1, keepdims=False)
+                embeddings = tf.reduce_mean(embeddings * tf.cast(self.probe.LayerWeights[f'lw_{task}'], embeddings.dtype),
+                                            axis=1, keepdims=False)
             _, projections = self.get_projections(embeddings, max_token_len, language, task)
             if embeddings_gate is not None:
                 projections = projections * embeddings_gate
@@ -312,17 +316,20 @@ class Network():
         def get_projections(self, embeddings, max_token_len, language, task):
             """ Computes projections after Orthogonal Transformation, and after Dimension Scaling"""
             embeddings = embeddings[:, :max_token_len, :]
+            # weights are cast to the precision of embeddings (e.g. bfloat16), projections are returned in float32
             orthogonal_projections = None
             if self.probe.ml_probe:
-                orthogonal_projections = embeddings @ self.probe.LanguageMaps[language]
+                orthogonal_projections = embeddings @ tf.cast(self.probe.LanguageMaps[language], embeddings.dtype)
             if (self.probe._orthogonal_reg and self.probe.ml_probe) or self.probe.with_sv:
-                projections = orthogonal_projections * self.DepthProbe[task]
+                projections = orthogonal_projections * tf.cast(self.DepthProbe[task], embeddings.dtype)
             elif self.probe.only_sv:
-                projections = embeddings * self.DepthProbe[task]
+                projections = embeddings * tf.cast(self.DepthProbe[task], embeddings.dtype)
             else:
-                projections = embeddings @ self.DepthProbe[task]
+                projections = embeddings @ tf.cast(self.DepthProbe[task], embeddings.dtype)
 
-            return orthogonal_projections, projections
+            if orthogonal_projections is not None:
+                orthogonal_projections = tf.cast(orthogonal_projections, tf.float32)
+            return orthogonal_projections, tf.cast(projections, tf.float32)
 
         @tf.function
         def _forward(self, embeddings, max_token_len, language, task, embeddings_gate=None):
@@ -330,7 +337,8 @@ class Network():
             Computes (Bh_i)^T(Bh_i) for all i
             """
             if self.probe.average_layers:
-                embeddings = tf.reduce_mean(embeddings * self.probe.LayerWeights[f'lw_{task}'], axis=1, keepdims=False)
+                embeddings = tf.reduce_mean(embeddings * tf.cast(self.probe.LayerWeights[f'lw_{task}'], embeddings.dtype),
+                                            axis=1, keepdims=False)
             _, projections = self.get_projections(embeddings, max_token_len, language, task)
 
             if embeddings_gate is not None:
@@ -433,38 +441,43 @@ class Network():
                                                              max_to_keep=1)
 
     @staticmethod
-    def decode(serialized_example, task, layer_idx, model):
+    def decode(serialized_examples, task, layer_idx, model):
+        """ Decodes a batch of serialized examples, parsing the whole batch at once is faster than one by one."""
         features_to_decode = {'num_tokens': tf.io.FixedLenFeature([], tf.int64),
                               'index': tf.io.FixedLenFeature([], tf.int64),
                               f'target_{task}': tf.io.FixedLenFeature([], tf.string),
-                              f'mask_{task}': tf.io.FixedLenFeature([], tf.string)
+                              f'mask_{task}': tf.io.FixedLenFeature([], tf.string),
+                              'all_layers': tf.io.FixedLenFeature([], tf.string)
                               }
-        if layer_idx == -1:
-            features_to_decode.update({f'layer_{idx}': tf.io.FixedLenFeature([], tf.string)
-                                       for idx in range(constants.MODEL_LAYERS[model])})
-        else:
-            features_to_decode[f'layer_{layer_idx}'] = tf.io.FixedLenFeature([], tf.string)
 
         x = tf.io.parse_example(
-            serialized_example,
+            serialized_examples,
             features=features_to_decode)
 
+        # tensors are stored as raw bytes, shapes are fixed so that the whole batch is reshaped at once
+        if 'distance' in task:
+            target_shape = [-1, constants.MAX_TOKENS, constants.MAX_TOKENS]
+        else:
+            target_shape = [-1, constants.MAX_TOKENS]
+        stored_layers = constants.PROBED_LAYERS or list(range(constants.MODEL_LAYERS[model]))
+        embeddings_shape = [-1, len(stored_layers), constants.MAX_WORDPIECES, constants.MODEL_DIMS[model]]
+
         index = tf.cast(x["index"], dtype=tf.int64)
-        target = tf.io.parse_tensor(x[f"target_{task}"], out_type=tf.float32)
-        mask = tf.io.parse_tensor(x[f"mask_{task}"], out_type=tf.float32)
+        target = tf.reshape(tf.io.decode_raw(x[f"target_{task}"], tf.float32), target_shape)
+        mask = tf.reshape(tf.io.decode_raw(x[f"mask_{task}"], tf.float32), target_shape)
         num_tokens = tf.cast(x["num_tokens"], dtype=tf.int64)
-        if layer_idx == -1:
-            embeddings = [tf.io.parse_tensor(x[f"layer_{idx}"], out_type=tf.float32)
-                          for idx in range(constants.MODEL_LAYERS[model])]
-            embeddings = tf.stack(embeddings, axis=0)
-
-        else:
-            embeddings = tf.io.parse_tensor(x[f"layer_{layer_idx}"], out_type=tf.float32)
+        embeddings = tf.reshape(tf.io.decode_raw(x["all_layers"], tf.float16), embeddings_shape)
+        if layer_idx != -1:
+            embeddings = embeddings[:, stored_layers.index(layer_idx)]
+        embeddings = tf.cast(embeddings, dtype=tf.float32)
 
         return index, target, mask, num_tokens, embeddings
 
     @staticmethod
     def data_pipeline(tf_data, languages, tasks, args, mode='train'):
+        if constants.PROBED_LAYERS is not None and args.layer_index not in constants.PROBED_LAYERS:
+            raise ValueError(f"Layer: {args.layer_index} is not saved in the tfrecord files\n"
+                             f" saved layers: {constants.PROBED_LAYERS}")
 
         datasets_to_interleve = []
         for langs in languages:
@@ -479,8 +492,10 @@ class Network():
 
                     data = tf_data[lang][task]
 
+                    data = data.batch(constants.DECODE_BATCH_SIZE)
                     data = data.map(partial(Network.decode, task=task, layer_idx=args.layer_index, model=args.model),
                                     num_parallel_calls=tf.data.experimental.AUTOTUNE)
+                    data = data.unbatch()
                     if lang in args.fs_dep_languages and 'dep_' in task and mode == 'train':
                         data = data.shuffle(constants.SHUFFLE_SIZE, args.seed)
                         data = data.take(args.fewshot_size)
@@ -492,6 +507,11 @@ class Network():
                     if mode == 'train':
                         data = data.shuffle(constants.SHUFFLE_SIZE, args.seed)
                     data = data.batch(args.batch_size)
+                    if getattr(args, 'bf16', False):
+                        # embeddings are passed to the probe in half precision
+                        data = data.map(lambda index, target, mask, num_tokens, embeddings:
+                                        (index, target, mask, num_tokens, tf.cast(embeddings, tf.bfloat16)),
+                                        num_parallel_calls=tf.data.experimental.AUTOTUNE)
                     data = data.map(lambda *x: (langs, task, x), num_parallel_calls=tf.data.experimental.AUTOTUNE)
                     data = data.prefetch(tf.data.experimental.AUTOTUNE)
                     datasets_to_interleve.append(data)
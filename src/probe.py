@@ -30,6 +30,8 @@ if __name__ == "__main__":
     parser.add_argument("--layer-index", default=6, type=int, help="Index of BERT's layer to probe."
                                                                    "If -1 all layers embeddings are averaged")
     parser.add_argument("--norm", default='euclidean', type=str, help="Distance/Depth Norm calculation. Available options same as ord attribute for tf.norm ['euclidean, 1, 2, 3, tf.inf']")
+    parser.add_argument("--bf16", action="store_true",
+                        help="Pass embeddings to the probe in bfloat16, probe projections are computed in bfloat16")
     # Train arguments
     parser.add_argument("--seed", default=42, type=int, help="Seed for variable initialisation")
     parser.add_argument("--batch-size", default=20, type=int, help="Batch size")
@@ -46,6 +46,8 @@ if __name__ == "__main__":
                                                                    "If -1 all layers embeddings are averaged")
     parser.add_argument("--norm", default='euclidean', type=str,
                         help="Distance/Depth Norm calculation. Available options same as ord attribute for tf.norm ['euclidean, 1, 2, 3, tf.inf']")
+    parser.add_argument("--bf16", action="store_true",
+                        help="Pass embeddings to the probe in bfloat16, probe projections are computed in bfloat16")
 
     # Specify Transformer Model
     parser.add_argument("--model",
@@ -116,7 +118,6 @@ if __name__ == "__main__":
         for language in args.languages:
             for lang in language.split('+'):
                 lang_conll = ConllWrapper(tf_reader.map_conll['test'][args.model][lang]['dep_distance'], tokenizer)
-                lang_conll.training_examples()
                 conll_dict[lang] = lang_conll
 
         if 'dep_depth' in args.tasks:
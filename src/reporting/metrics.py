@@ -4,6 +4,13 @@ from collections import defaultdict
 from scipy import stats
 
 
+def pearson_rho(x, y):
+    """ Pearson correlation coefficient, without input validation and p-value computation of `stats.pearsonr`.
+    Returns nan for constant inputs."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.corrcoef(x, y)[0, 1]
+
+
 class Metric:
 
     def __init__(self, *args, **kwargs):
@@ -44,10 +51,10 @@ class UAS(Metric):
         self.all_gold = 0
 
     def update_state(self, sent_gold, sent_predicted):
-
+        """ Edges are arrays of unique integers, each encoding a (dependent, head) pair."""
         self.all_gold += len(sent_gold)
         self.all_predicted += len(sent_predicted)
-        self.all_correct += len(sent_gold.intersection(sent_predicted))
+        self.all_correct += np.intersect1d(sent_gold, sent_predicted, assume_unique=True).size
 
     def result(self):
         if not self.all_correct:
@@ -89,27 +96,36 @@ class Spearman(Metric):
 
         super().__init__()
 
-    def __call__(self, gold, predicted, mask=None):
-        if mask:
-            for sent_gold, sent_predicted, sent_mask in zip(gold, predicted, mask):
-                self.update_state(sent_gold, sent_predicted, sent_mask)
-        else:
-            for sent_gold, sent_predicted in zip(gold, predicted):
-                self.update_state(sent_gold, sent_predicted)
+    def __call__(self, gold, predicted, mask=None, lengths=None):
+        """ Sentences can be padded, in that case their lengths are passed in `lengths`."""
+        if lengths is None:
+            lengths = [sent_gold.shape[0] for sent_gold in gold]
+        if mask is None:
+            mask = [None] * len(lengths)
+        for sent_gold, sent_predicted, sent_mask, sent_len in zip(gold, predicted, mask, lengths):
+            self.update_state(sent_gold, sent_predicted, sent_mask, sent_len)
 
     def reset_state(self):
         self.per_sent_len = defaultdict(list)
 
-    def update_state(self, sent_gold, sent_predicted, sent_mask=None):
-        sent_len = sent_gold.shape[0]
+    def update_state(self, sent_gold, sent_predicted, sent_mask=None, sent_len=None):
+        if sent_len is None:
+            sent_len = sent_gold.shape[0]
+        if not self.min_len <= sent_len <= self.max_len:
+            return
+        # padding is sliced off along all the token dimensions
+        sent_slice = (slice(sent_len),) * sent_gold.ndim
+        sent_gold = sent_gold[sent_slice]
+        sent_predicted = sent_predicted[sent_slice]
         if sent_mask is not None:
+            sent_mask = sent_mask[sent_slice]
             sent_gold = sent_gold[sent_mask]
             sent_predicted = sent_predicted[sent_mask]
 
-        if self.min_len <= sent_len <= self.max_len:
-            rho, _ = stats.spearmanr(sent_gold, sent_predicted, axis=None)
-            if np.isfinite(rho):
-                self.per_sent_len[sent_len].append(rho)
+        # Spearman's rho is Pearson's correlation of ranks
+        rho = pearson_rho(stats.rankdata(sent_gold), stats.rankdata(sent_predicted))
+        if np.isfinite(rho):
+            self.per_sent_len[sent_len].append(rho)
 
     def result(self):
         return {sent_len: np.array(self.per_sent_len[sent_len]).mean() for sent_len in
@@ -124,27 +140,35 @@ class Pearson(Metric):
 
         super().__init__()
 
-    def __call__(self, gold, predicted, mask=None):
-        if mask:
-            for sent_gold, sent_predicted, sent_mask in zip(gold, predicted, mask):
-                self.update_state(sent_gold, sent_predicted, sent_mask)
-        else:
-            for sent_gold, sent_predicted in zip(gold, predicted):
-                self.update_state(sent_gold, sent_predicted)
+    def __call__(self, gold, predicted, mask=None, lengths=None):
+        """ Sentences can be padded, in that case their lengths are passed in `lengths`."""
+        if lengths is None:
+            lengths = [sent_gold.shape[0] for sent_gold in gold]
+        if mask is None:
+            mask = [None] * len(lengths)
+        for sent_gold, sent_predicted, sent_mask, sent_len in zip(gold, predicted, mask, lengths):
+            self.update_state(sent_gold, sent_predicted, sent_mask, sent_len)
 
     def reset_state(self):
         self.per_sent_len = defaultdict(list)
 
-    def update_state(self, sent_gold, sent_predicted, sent_mask=None):
-        sent_len = sent_gold.shape[0]
+    def update_state(self, sent_gold, sent_predicted, sent_mask=None, sent_len=None):
+        if sent_len is None:
+            sent_len = sent_gold.shape[0]
+        if not self.min_len <= sent_len <= self.max_len:
+            return
+        # padding is sliced off along all the token dimensions
+        sent_slice = (slice(sent_len),) * sent_gold.ndim
+        sent_gold = sent_gold[sent_slice]
+        sent_predicted = sent_predicted[sent_slice]
         if sent_mask is not None:
+            sent_mask = sent_mask[sent_slice]
             sent_gold = sent_gold[sent_mask]
             sent_predicted = sent_predicted[sent_mask]
 
-        if self.min_len <= sent_len <= self.max_len:
-            rho, _ = stats.pearsonr(sent_gold, sent_predicted)
-            if np.isfinite(rho):
-                self.per_sent_len[sent_len].append(rho)
+        rho = pearson_rho(sent_gold.ravel(), sent_predicted.ravel())
+        if np.isfinite(rho):
+            self.per_sent_len[sent_len].append(rho)
 
     def result(self):
         return {sent_len: np.array(self.per_sent_len[sent_len]).mean() for sent_len in
@@ -159,27 +183,35 @@ class Kendall(Metric):
 
         super().__init__()
 
-    def __call__(self, gold, predicted, mask=None):
-        if mask:
-            for sent_gold, sent_predicted, sent_mask in zip(gold, predicted, mask):
-                self.update_state(sent_gold, sent_predicted, sent_mask)
-        else:
-            for sent_gold, sent_predicted in zip(gold, predicted):
-                self.update_state(sent_gold, sent_predicted)
+    def __call__(self, gold, predicted, mask=None, lengths=None):
+        """ Sentences can be padded, in that case their lengths are passed in `lengths`."""
+        if lengths is None:
+            lengths = [sent_gold.shape[0] for sent_gold in gold]
+        if mask is None:
+            mask = [None] * len(lengths)
+        for sent_gold, sent_predicted, sent_mask, sent_len in zip(gold, predicted, mask, lengths):
+            self.update_state(sent_gold, sent_predicted, sent_mask, sent_len)
 
     def reset_state(self):
         self.per_sent_len = defaultdict(list)
 
-    def update_state(self, sent_gold, sent_predicted, sent_mask=None):
-        sent_len = sent_gold.shape[0]
+    def update_state(self, sent_gold, sent_predicted, sent_mask=None, sent_len=None):
+        if sent_len is None:
+            sent_len = sent_gold.shape[0]
+        if not self.min_len <= sent_len <= self.max_len:
+            return
+        # padding is sliced off along all the token dimensions
+        sent_slice = (slice(sent_len),) * sent_gold.ndim
+        sent_gold = sent_gold[sent_slice]
+        sent_predicted = sent_predicted[sent_slice]
         if sent_mask is not None:
+            sent_mask = sent_mask[sent_slice]
             sent_gold = sent_gold[sent_mask]
             sent_predicted = sent_predicted[sent_mask]
 
-        if self.min_len <= sent_len <= self.max_len:
-            tau, _ = stats.kendalltau(sent_gold, sent_predicted)
-            if np.isfinite(tau):
-                self.per_sent_len[sent_len].append(tau)
+        tau, _ = stats.kendalltau(sent_gold, sent_predicted)
+        if np.isfinite(tau):
+            self.per_sent_len[sent_len].append(tau)
 
     def result(self):
         return {sent_len: np.array(self.per_sent_len[sent_len]).mean() for sent_len in
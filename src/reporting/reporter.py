@@ -2,13 +2,31 @@ import tensorflow as tf
 import numpy as np
 from tqdm import tqdm
 import os
+import math
+import threading
 from scipy import sparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from ufal.chu_liu_edmonds import chu_liu_edmonds
 
+import constants
 from network import Network
 
 from reporting.metrics import UAS, Spearman, Pearson, Kendall
+from reporting.reporter_kernels import undirected_removed_edges, directed_removed_edges
+
+
+def pack_edges(dependents, heads):
+    """ Packs (dependent, head) pairs into single integers, so that edge sets are compared as int arrays."""
+    return np.asarray(dependents, dtype=np.int64) * (constants.MAX_TOKENS + 1) + np.asarray(heads, dtype=np.int64)
+
+
+def sparse_graph(scores, removed_edges):
+    """ Graph of the edges that are not removed. As in dense csgraph input, zero and nan scores are not edges."""
+    kept_edges = ~removed_edges & (scores != 0) & ~np.isnan(scores)
+    rows, cols = np.nonzero(kept_edges)
+    return sparse.csr_matrix((scores[rows, cols], (rows, cols)), shape=scores.shape)
 
 
 class Reporter():
@@ -27,52 +45,51 @@ class Reporter():
             diagonal_probe = self.network.distance_probe.DistanceProbe[task].numpy()
         elif 'depth' in task:
             diagonal_probe = self.network.depth_probe.DepthProbe[task].numpy()
-        embedding_gate = (np.abs(diagonal_probe) > self._probe_threshold).astype(np.float)
+        embedding_gate = (np.abs(diagonal_probe) > self._probe_threshold).astype(np.float32)
         
         if self._drop_parts:
             dim_num = np.sum(embedding_gate)
             part_start = int(dim_num * part_to_drop / self._drop_parts)
             part_end = int(dim_num * (part_to_drop+1) / self._drop_parts)
-            dims_to_drop = np.where(embedding_gate)[-1][part_start:part_end]
-            embedding_gate[...,dims_to_drop] = 0.
+            # selected dimensions are counted in order, the ones with count in (part_start, part_end] are dropped
+            selected = embedding_gate != 0
+            selected_count = np.cumsum(selected, axis=-1)
+            embedding_gate[selected & (selected_count > part_start) & (selected_count <= part_end)] = 0.
         
-        return tf.constant(embedding_gate, dtype=tf.float32)
+        return tf.convert_to_tensor(embedding_gate)
     
     def predict(self, args, language, lang, task):
         data_pipe = Network.data_pipeline(self.dataset, [lang], [task], args, mode=self.dataset_name)
-        validation_steps = self._drop_parts or 1
         
-        for part_to_drop in range(validation_steps):
-            progressbar = tqdm(enumerate(data_pipe), desc="Predicting, {}, {}".format(language, task))
-            for batch_idx, (_, _, batch) in progressbar:
-                conll_indicies, batch_target, batch_mask, batch_num_tokens, batch_embeddings = batch
-                
-                if self._probe_threshold:
-                    embedding_gate = self.get_embedding_gate(task, part_to_drop)
-                else:
-                    embedding_gate = None
-                
-                if 'distance' in task:
-                    pred_values = self.network.distance_probe.predict_on_batch(batch_num_tokens, batch_embeddings,
-                                                                               language, task, embedding_gate)
-                    pred_values = [sent_predicted.numpy()[:sent_len, :sent_len] for sent_predicted, sent_len
-                                   in zip(tf.unstack(pred_values), batch_num_tokens)]
-                    gold_values = [sent_gold.numpy()[:sent_len, :sent_len] for sent_gold, sent_len
-                                   in zip(tf.unstack(batch_target), batch_num_tokens)]
-                    mask = [sent_mask.numpy().astype(bool)[:sent_len, :sent_len] for sent_mask, sent_len
-                            in zip(tf.unstack(batch_mask), batch_num_tokens)]
-                elif 'depth' in task:
-                    pred_values = self.network.depth_probe.predict_on_batch(batch_num_tokens, batch_embeddings,
-                                                                            language, task, embedding_gate)
-                    pred_values = [sent_predicted.numpy()[:sent_len] for sent_predicted, sent_len
-                                   in zip(tf.unstack(pred_values), batch_num_tokens)]
-                    gold_values = [sent_gold.numpy()[:sent_len] for sent_gold, sent_len
-                                   in zip(tf.unstack(batch_target), batch_num_tokens)]
-                    mask = [sent_mask.numpy().astype(bool)[:sent_len] for sent_mask, sent_len
-                            in zip(tf.unstack(batch_mask), batch_num_tokens)]
-                else:
-                    raise ValueError("Unrecognized task, need to contain either `distance` or `depth` in name.")
-                yield conll_indicies, batch_num_tokens, pred_values, gold_values, mask
+        # gates depend only on the task and dropped part, so they are the same for all the batches
+        if self._probe_threshold:
+            embedding_gates = [self.get_embedding_gate(task, part_to_drop)
+                               for part_to_drop in range(self._drop_parts or 1)]
+        else:
+            embedding_gates = [None]
+        
+        if 'distance' in task:
+            probe = self.network.distance_probe
+        elif 'depth' in task:
+            probe = self.network.depth_probe
+        else:
+            raise ValueError("Unrecognized task, need to contain either `distance` or `depth` in name.")
+        
+        progressbar = tqdm(enumerate(data_pipe), desc="Predicting, {}, {}".format(language, task))
+        for batch_idx, (_, _, batch) in progressbar:
+            conll_indicies, batch_target, batch_mask, batch_num_tokens, batch_embeddings = batch
+            
+            # whole batch is copied from the device at once, padded arrays are yielded with the sentence lengths,
+            # consumers slice the sentences to their lengths
+            num_tokens = batch_num_tokens.numpy()
+            gold_values = batch_target.numpy()
+            mask = batch_mask.numpy().astype(bool)
+            
+            # the data are read once, predictions with the gate of each dropped part are computed for the same batch
+            for embedding_gate in embedding_gates:
+                pred_values = probe.predict_on_batch(batch_num_tokens, batch_embeddings, language, task,
+                                                     embedding_gate)
+                yield conll_indicies, num_tokens, pred_values.numpy(), gold_values, mask
 
 
 class CorrelationReporter(Reporter):
@@ -104,12 +121,15 @@ class CorrelationReporter(Reporter):
                         if self._drop_parts:
                             prefix += 'dp{}.'.format(self._drop_parts)
                     
+                    correlations = self.correlation_d[lang][task].result()
                     with open(os.path.join(args.out_dir, prefix + 'spearman'), 'w') as sperarman_f:
-                        for sent_l, val in self.correlation_d[lang][task].result().items():
+                        for sent_l, val in correlations.items():
                             sperarman_f.write(f'{sent_l}\t{val}\n')
                     
                     with open(os.path.join(args.out_dir, prefix + 'spearman_mean'), 'w') as sperarman_mean_f:
-                        result = str(np.nanmean(np.fromiter(self.correlation_d[lang][task].result().values(), dtype=float)))
+                        # mean over sentence lengths, lengths without any sentence are nan
+                        values = [val for val in correlations.values() if not math.isnan(val)]
+                        result = str(math.fsum(values) / len(values) if values else math.nan)
                         sperarman_mean_f.write(result + '\n')
     
     def compute(self, args):
@@ -117,20 +137,24 @@ class CorrelationReporter(Reporter):
         for language in self._languages:
             for lang in language.split('+'):
                 for task in self._tasks:
-                    self.correlation_d[lang][task] = self.correlation_metric
-                    for _, _, pred_values, gold_values, mask in self.predict(args, language, lang, task):
-                        self.correlation_d[lang][task](gold_values, pred_values, mask)
+                    self.correlation_d[lang][task] = self.correlation_metric()
+                    for _, num_tokens, pred_values, gold_values, mask in self.predict(args, language, lang, task):
+                        self.correlation_d[lang][task](gold_values, pred_values, mask, num_tokens)
 
 
 class UASReporter(Reporter):
     def __init__(self, args, network, dataset, dataset_name, conll_dict, depths=None):
         super().__init__(args, network, dataset, dataset_name)
-        self.punctuation_masks = {lang: conll_data.punctuation_mask for lang, conll_data in conll_dict.items()}
+        # masks are converted to arrays once, so that they can be broadcasted in tree computation
+        self.punctuation_masks = {lang: [np.asarray(sent_mask, dtype=bool) for sent_mask in conll_data.punctuation_mask]
+                                  for lang, conll_data in conll_dict.items()}
         self.uu_rels = {lang: conll_data.filtered_relations for lang, conll_data in conll_dict.items()}
         self._languages = args.languages
         self.uas = dict()
         
         self.depths = depths
+        # score matrices of directed trees are reused between sentences, separately by each thread
+        self._tree_buffers = threading.local()
     
     def write(self, args):
         for language in self._languages:
@@ -148,78 +172,100 @@ class UASReporter(Reporter):
                         uuas_f.write(str(self.uas[lang].result())+'\n')
     
     def undirected_tree(self, lang, conll_idx, sent_predicted, sent_gold, sent_len):
-        sent_punctuation_mask = self.punctuation_masks[lang][conll_idx]
-    
-        for i in range(sent_len):
-            for j in range(sent_len):
-                if sent_punctuation_mask[i] or sent_punctuation_mask[j]:
-                    sent_predicted[i, j] = np.inf
-                    sent_gold[i, j] = np.inf
-                else:
-                    if i > j:
-                        sent_predicted[i, j] = np.inf
-                        sent_gold[i, j] = np.inf
-                        
-        min_spanning_tree = sparse.csgraph.minimum_spanning_tree(sent_predicted).tocoo()
-        min_spanning_tree_gold = sparse.csgraph.minimum_spanning_tree(sent_gold).tocoo()
+        # a single word has no edges
+        if sent_len <= 1:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        sent_punctuation_mask = self.punctuation_masks[lang][conll_idx][:sent_len]
+        
+        # edges from or to punctuation and below the diagonal (i > j) are removed
+        removed_edges = undirected_removed_edges(sent_punctuation_mask)
+        # graphs are built only from the remaining edges, instead of dense matrices with removed edges set to inf
+        min_spanning_tree = sparse.csgraph.minimum_spanning_tree(
+            sparse_graph(sent_predicted[:sent_len, :sent_len], removed_edges)).tocoo()
+        min_spanning_tree_gold = sparse.csgraph.minimum_spanning_tree(
+            sparse_graph(sent_gold[:sent_len, :sent_len], removed_edges)).tocoo()
     
-        predicted = set(map(tuple, zip(min_spanning_tree.col + 1, min_spanning_tree.row + 1)))
-        gold = set(map(tuple, zip(min_spanning_tree_gold.col + 1, min_spanning_tree_gold.row + 1)))
+        predicted = pack_edges(min_spanning_tree.col + 1, min_spanning_tree.row + 1)
+        gold = pack_edges(min_spanning_tree_gold.col + 1, min_spanning_tree_gold.row + 1)
         
         return predicted, gold
     
+    def with_root_buffers(self, size):
+        """ Returns two contiguous [size, size] matrices of the calling thread, contents are not initialized."""
+        if not hasattr(self._tree_buffers, 'predicted'):
+            max_size = (constants.MAX_TOKENS + 1) ** 2
+            self._tree_buffers.predicted = np.empty(max_size, dtype=np.float64)
+            self._tree_buffers.gold = np.empty(max_size, dtype=np.float64)
+        return (self._tree_buffers.predicted[:size * size].reshape(size, size),
+                self._tree_buffers.gold[:size * size].reshape(size, size))
+    
     def directed_tree(self, lang, conll_idx, sent_predicted, sent_gold, sent_len):
-        sent_punctuation_mask = self.punctuation_masks[lang][conll_idx]
-        predicted_depths = self.depths[lang][conll_idx]["predicted"]
-        gold_depths = self.depths[lang][conll_idx]["gold"]
+        sent_punctuation_mask = self.punctuation_masks[lang][conll_idx][:sent_len]
+        # a single word is attached to the root, both in predicted and gold tree
+        if sent_len <= 1:
+            dependents = np.arange(1, sent_len + 1)[~sent_punctuation_mask]
+            root_edges = pack_edges(dependents, np.zeros_like(dependents))
+            return root_edges, root_edges.copy()
+        sent_predicted = sent_predicted[:sent_len, :sent_len]
+        sent_gold = sent_gold[:sent_len, :sent_len]
+        predicted_depths = np.asarray(self.depths[lang][conll_idx]["predicted"])
+        gold_depths = np.asarray(self.depths[lang][conll_idx]["gold"])
         predicted_root = np.argmin(predicted_depths) + 1
         gold_root = np.argmin(gold_depths) + 1
         
-        sent_predicted_with_root = np.full((sent_predicted.shape[0]+1, sent_predicted.shape[0]+1), np.nan)
-        sent_gold_with_root = np.full((sent_gold.shape[0]+1, sent_gold.shape[0]+1), np.nan)
-        sent_predicted_with_root[1:,1:] = -sent_predicted
-        sent_gold_with_root[1:,1:] = -sent_gold
-        for i in range(sent_len):
-            # connect punctuation directtly to the root, they are disregarded anyway
-            if sent_punctuation_mask[i]:
-                sent_predicted_with_root[i+1,0] = 0.
-                sent_gold_with_root[i+1,0] = 0.
-            for j in range(sent_len):
-                if sent_punctuation_mask[i] or sent_punctuation_mask[j]:
-                    sent_predicted_with_root[i+1, j+1] = np.nan
-                    sent_gold_with_root[i+1, j+1] = np.nan
-                else:
-                    if predicted_depths[i] <= predicted_depths[j]:
-                        sent_predicted_with_root[i+1, j+1] = np.nan
-                    if gold_depths[i] <=  gold_depths[j]:
-                        sent_gold_with_root[i+1, j+1] = np.nan
-                        
+        sent_predicted_with_root, sent_gold_with_root = self.with_root_buffers(sent_predicted.shape[0] + 1)
+        # edges to the root and from the root are absent (nan), scores of the other edges are overwritten
+        for sent_with_root, sent_scores in ((sent_predicted_with_root, sent_predicted), (sent_gold_with_root, sent_gold)):
+            sent_with_root[0, :] = np.nan
+            sent_with_root[1:, 0] = np.nan
+            np.negative(sent_scores, out=sent_with_root[1:, 1:])
+        # connect punctuation directtly to the root, they are disregarded anyway
+        np.copyto(sent_predicted_with_root[1:sent_len+1, 0], 0., where=sent_punctuation_mask)
+        np.copyto(sent_gold_with_root[1:sent_len+1, 0], 0., where=sent_punctuation_mask)
+        
+        # edges from or to punctuation and from a word to a deeper (or equally deep) word are removed
+        predicted_removed = directed_removed_edges(sent_punctuation_mask, predicted_depths[:sent_len])
+        gold_removed = directed_removed_edges(sent_punctuation_mask, gold_depths[:sent_len])
+        np.copyto(sent_predicted_with_root[1:sent_len+1, 1:sent_len+1], np.nan, where=predicted_removed)
+        np.copyto(sent_gold_with_root[1:sent_len+1, 1:sent_len+1], np.nan, where=gold_removed)
+        
         sent_predicted_with_root[predicted_root,0] = 0.
         sent_gold_with_root[gold_root,0] = 0.
         
         predicted_heads, _ = chu_liu_edmonds(sent_predicted_with_root)
         gold_heads, gold_tree_score = chu_liu_edmonds(sent_gold_with_root)
 
-        predicted = set([(dep, head) for dep, head, is_punctuation
-                         in zip(range(1,sent_len+1), predicted_heads[1:],sent_punctuation_mask) if not is_punctuation])
-        gold = set([(dep, head) for dep, head, is_punctuation
-                    in zip(range(1,sent_len+1), gold_heads[1:],sent_punctuation_mask) if not is_punctuation])
+        # punctuation is disregarded
+        dependents = np.arange(1, sent_len + 1)[~sent_punctuation_mask]
+        predicted = pack_edges(dependents, np.asarray(predicted_heads)[dependents])
+        gold = pack_edges(dependents, np.asarray(gold_heads)[dependents])
         # predicted = set(zip(range(1,sent_len+1),predicted_heads))
         # gold = set(zip(range(1,sent_len+1), gold_heads))
         
         return predicted, gold
         
+    def tree(self, lang, conll_idx, sent_predicted, sent_gold, sent_len):
+        if self.depths:
+            return self.directed_tree(lang, conll_idx, sent_predicted, sent_gold, sent_len)
+        return self.undirected_tree(lang, conll_idx, sent_predicted, sent_gold, sent_len)
+    
     def compute(self, args):
         
-        for language in self._languages:
-            for lang in language.split('+'):
-                self.uas[lang] = UAS()
-                for conll_indices, num_tokens, pred_values, gold_values, mask in self.predict(args, language, lang, 'dep_distance'):
-                    for conll_idx, sent_predicted, sent_gold, sent_len in zip(conll_indices.numpy(), pred_values, gold_values, num_tokens):
-                        if self.depths:
-                            predicted, gold = self.directed_tree(lang, conll_idx, sent_predicted, sent_gold, sent_len)
-                        else:
-                            predicted, gold = self.undirected_tree(lang, conll_idx, sent_predicted, sent_gold, sent_len)
+        # trees of sentences in a batch are computed in parallel, MST and Chu-Liu-Edmonds algorithms are C extensions
+        with ThreadPoolExecutor() as executor:
+            for language in self._languages:
+                for lang in language.split('+'):
+                    self.uas[lang] = UAS()
+                    # results of a batch are collected after the next batch is predicted,
+                    # so that the trees are computed while the probe runs
+                    previous_trees = []
+                    for conll_indices, num_tokens, pred_values, gold_values, mask in self.predict(args, language, lang, 'dep_distance'):
+                        trees = executor.map(partial(self.tree, lang), conll_indices.numpy(), pred_values, gold_values,
+                                             num_tokens)
+                        for predicted, gold in previous_trees:
+                            self.uas[lang].update_state(gold, predicted)
+                        previous_trees = trees
+                    for predicted, gold in previous_trees:
                         self.uas[lang].update_state(gold, predicted)
 
 
@@ -233,8 +279,8 @@ class DependencyDepthReporter(Reporter):
         for language in args.languages:
             for lang in language.split('+'):
                 for conll_indices, num_tokens, pred_values, gold_values, mask in self.predict(args, language, lang, 'dep_depth'):
-                    for conll_idx, sent_predicted, sent_gold in zip(conll_indices.numpy(), pred_values, gold_values):
-                        results[lang][conll_idx] = {'predicted': sent_predicted, 'gold': sent_gold}
+                    for conll_idx, sent_predicted, sent_gold, sent_len in zip(conll_indices.numpy(), pred_values, gold_values, num_tokens):
+                        results[lang][conll_idx] = {'predicted': sent_predicted[:sent_len], 'gold': sent_gold[:sent_len]}
         
         return results
 
@@ -265,11 +311,7 @@ class SelectedDimensionalityReporter(Reporter):
     
     def compute(self, args):
         for language in self._languages:
-            self.dimension_matrices[language] = np.zeros((len(self._tasks), len(self._tasks)), dtype=np.int)
-            selected_dims = dict()
-            for task_idx, task in enumerate(self._tasks):
-                selected_dims[task_idx] = self.get_embedding_gate(task)
-                for task_jdx in range(task_idx+1):
-                    dims_n = tf.math.reduce_sum(selected_dims[task_idx] * selected_dims[task_jdx]).numpy().astype(int)
-                    self.dimension_matrices[language][task_idx, task_jdx] = dims_n
-                    self.dimension_matrices[language][task_jdx, task_idx] = dims_n
+            # gates of all the tasks are stacked, so that the numbers of common dimensions are computed by one matmul
+            selected_dims = tf.stack([tf.reshape(self.get_embedding_gate(task), [-1]) for task in self._tasks])
+            dims_n = tf.matmul(selected_dims, selected_dims, transpose_b=True)
+            self.dimension_matrices[language] = np.rint(dims_n.numpy()).astype(np.int32)
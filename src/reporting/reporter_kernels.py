@@ -0,0 +1,51 @@
+"""Masks of edges removed before dependency tree decoding.
+
+When numba is installed the masks are computed by compiled kernels in a single pass,
+otherwise numpy broadcasting is used."""
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, boundscheck=False)
+    def undirected_removed_edges(punctuation_mask):
+        """ Edges from or to punctuation and below the diagonal (i > j)."""
+        n = punctuation_mask.shape[0]
+        removed = np.empty((n, n), dtype=np.bool_)
+        for i in range(n):
+            for j in range(n):
+                removed[i, j] = i > j or punctuation_mask[i] or punctuation_mask[j]
+        return removed
+
+    @njit(cache=True, boundscheck=False)
+    def directed_removed_edges(punctuation_mask, depths):
+        """ Edges from or to punctuation and from a word to a deeper (or equally deep) word."""
+        n = punctuation_mask.shape[0]
+        removed = np.empty((n, n), dtype=np.bool_)
+        for i in range(n):
+            for j in range(n):
+                removed[i, j] = punctuation_mask[i] or punctuation_mask[j] or depths[i] <= depths[j]
+        return removed
+
+else:
+    @lru_cache(maxsize=256)
+    def lower_triangle_mask(n):
+        """ Boolean [n, n] mask of entries below the diagonal (i > j), cached for each sentence length."""
+        mask = np.tri(n, n, k=-1, dtype=bool)
+        # the same array is shared by all the calls
+        mask.flags.writeable = False
+        return mask
+
+    def undirected_removed_edges(punctuation_mask):
+        """ Edges from or to punctuation and below the diagonal (i > j)."""
+        return punctuation_mask[:, None] | punctuation_mask[None, :] | lower_triangle_mask(len(punctuation_mask))
+
+    def directed_removed_edges(punctuation_mask, depths):
+        """ Edges from or to punctuation and from a word to a deeper (or equally deep) word."""
+        return punctuation_mask[:, None] | punctuation_mask[None, :] | (depths[:, None] <= depths[None, :])
@@ -0,0 +1,43 @@
+import pytest
+import sys, os
+
+import numpy as np
+
+sys.path.append(os.path.abspath('../src'))
+from reporting.metrics import Spearman, Pearson, Kendall
+
+
+@pytest.fixture
+def sentences():
+	rng = np.random.RandomState(0)
+	lengths = [5, 7, 6]
+	gold = [rng.rand(sent_len, sent_len) for sent_len in lengths]
+	predicted = [rng.rand(sent_len, sent_len) for sent_len in lengths]
+	mask = [rng.rand(sent_len, sent_len) > 0.2 for sent_len in lengths]
+	return lengths, gold, predicted, mask
+
+
+def pad(sent_arrays, max_len, value):
+	padded = np.full((len(sent_arrays), max_len, max_len), value, dtype=sent_arrays[0].dtype)
+	for sent_idx, sent_array in enumerate(sent_arrays):
+		padded[sent_idx, :sent_array.shape[0], :sent_array.shape[1]] = sent_array
+	return padded
+
+
+@pytest.mark.parametrize("metric_class", [Spearman, Pearson, Kendall])
+def test_correlation_padded_batch(sentences, metric_class):
+	lengths, gold, predicted, mask = sentences
+
+	unpadded_metric = metric_class()
+	unpadded_metric(gold, predicted, mask)
+
+	# padding differs between arrays, as targets and predictions are padded to different lengths
+	padded_metric = metric_class()
+	padded_metric(pad(gold, 10, 1.), pad(predicted, 8, -1.), pad(mask, 10, True), np.array(lengths))
+
+	unpadded_result = unpadded_metric.result()
+	padded_result = padded_metric.result()
+	for sent_len in lengths:
+		assert np.isfinite(padded_result[sent_len])
+	np.testing.assert_allclose(np.array(list(padded_result.values())),
+	                           np.array(list(unpadded_result.values())))
@@ -0,0 +1,144 @@
+import pytest
+import sys, os
+from types import SimpleNamespace
+
+import numpy as np
+from scipy import sparse
+from ufal.chu_liu_edmonds import chu_liu_edmonds
+
+sys.path.append(os.path.abspath('../src'))
+import constants
+from reporting.reporter import UASReporter
+from reporting import reporter_kernels
+
+
+PADDED_LEN = 16
+
+
+def baseline_undirected_tree(sent_punctuation_mask, sent_predicted, sent_gold, sent_len):
+	# reference implementation with nested loops and dense matrices, the matrices are modified in place
+	for i in range(sent_len):
+		for j in range(sent_len):
+			if sent_punctuation_mask[i] or sent_punctuation_mask[j]:
+				sent_predicted[i, j] = np.inf
+				sent_gold[i, j] = np.inf
+			else:
+				if i > j:
+					sent_predicted[i, j] = np.inf
+					sent_gold[i, j] = np.inf
+
+	min_spanning_tree = sparse.csgraph.minimum_spanning_tree(sent_predicted).tocoo()
+	min_spanning_tree_gold = sparse.csgraph.minimum_spanning_tree(sent_gold).tocoo()
+
+	predicted = set(map(tuple, zip(min_spanning_tree.col + 1, min_spanning_tree.row + 1)))
+	gold = set(map(tuple, zip(min_spanning_tree_gold.col + 1, min_spanning_tree_gold.row + 1)))
+	return predicted, gold
+
+
+def baseline_directed_tree(sent_punctuation_mask, predicted_depths, gold_depths, sent_predicted, sent_gold, sent_len):
+	# reference implementation with nested loops and a new matrix for each sentence
+	predicted_root = np.argmin(predicted_depths) + 1
+	gold_root = np.argmin(gold_depths) + 1
+
+	sent_predicted_with_root = np.full((sent_predicted.shape[0]+1, sent_predicted.shape[0]+1), np.nan)
+	sent_gold_with_root = np.full((sent_gold.shape[0]+1, sent_gold.shape[0]+1), np.nan)
+	sent_predicted_with_root[1:,1:] = -sent_predicted
+	sent_gold_with_root[1:,1:] = -sent_gold
+	for i in range(sent_len):
+		if sent_punctuation_mask[i]:
+			sent_predicted_with_root[i+1,0] = 0.
+			sent_gold_with_root[i+1,0] = 0.
+		for j in range(sent_len):
+			if sent_punctuation_mask[i] or sent_punctuation_mask[j]:
+				sent_predicted_with_root[i+1, j+1] = np.nan
+				sent_gold_with_root[i+1, j+1] = np.nan
+			else:
+				if predicted_depths[i] <= predicted_depths[j]:
+					sent_predicted_with_root[i+1, j+1] = np.nan
+				if gold_depths[i] <= gold_depths[j]:
+					sent_gold_with_root[i+1, j+1] = np.nan
+
+	sent_predicted_with_root[predicted_root,0] = 0.
+	sent_gold_with_root[gold_root,0] = 0.
+
+	predicted_heads, _ = chu_liu_edmonds(sent_predicted_with_root)
+	gold_heads, _ = chu_liu_edmonds(sent_gold_with_root)
+
+	predicted = set([(dep, head) for dep, head, is_punctuation
+	                 in zip(range(1,sent_len+1), predicted_heads[1:],sent_punctuation_mask) if not is_punctuation])
+	gold = set([(dep, head) for dep, head, is_punctuation
+	            in zip(range(1,sent_len+1), gold_heads[1:],sent_punctuation_mask) if not is_punctuation])
+	return predicted, gold
+
+
+def unpack_edges(packed):
+	return set((int(dependent), int(head)) for dependent, head in zip(*np.divmod(packed, constants.MAX_TOKENS + 1)))
+
+
+@pytest.fixture
+def sentences():
+	rng = np.random.RandomState(0)
+	# lengths alternate, so that buffers of directed trees are reused for shorter and longer sentences
+	lengths = [9, 1, 14, 2, 5, 1, 4, 16, 3, 7]
+	punctuation_masks = [rng.rand(sent_len) < 0.25 for sent_len in lengths]
+	# a one-word sentence with punctuation, and a sentence of only punctuation
+	punctuation_masks[5][:] = True
+	punctuation_masks[6][:] = True
+	# scores are padded with random values, which should be ignored
+	predicted = [rng.rand(PADDED_LEN, PADDED_LEN) + 0.01 for _ in lengths]
+	gold = [rng.rand(PADDED_LEN, PADDED_LEN) + 0.01 for _ in lengths]
+	depths = {conll_idx: {'predicted': rng.rand(sent_len), 'gold': rng.rand(sent_len)}
+	          for conll_idx, sent_len in enumerate(lengths)}
+	return lengths, punctuation_masks, predicted, gold, depths
+
+
+def make_reporter(punctuation_masks, depths=None):
+	args = SimpleNamespace(probe_threshold=None, drop_parts=None, languages=['en'])
+	conll_dict = {'en': SimpleNamespace(punctuation_mask=punctuation_masks, filtered_relations=None)}
+	return UASReporter(args, None, None, 'test', conll_dict, depths=depths)
+
+
+def test_undirected_tree_matches_baseline(sentences):
+	lengths, punctuation_masks, predicted, gold, _ = sentences
+	reporter = make_reporter(punctuation_masks)
+
+	for conll_idx, sent_len in enumerate(lengths):
+		expected_predicted, expected_gold = baseline_undirected_tree(
+			punctuation_masks[conll_idx], predicted[conll_idx][:sent_len, :sent_len].copy(),
+			gold[conll_idx][:sent_len, :sent_len].copy(), sent_len)
+		tree_predicted, tree_gold = reporter.tree('en', conll_idx, predicted[conll_idx], gold[conll_idx], sent_len)
+
+		assert unpack_edges(tree_predicted) == expected_predicted
+		assert unpack_edges(tree_gold) == expected_gold
+
+
+def test_directed_tree_matches_baseline(sentences):
+	lengths, punctuation_masks, predicted, gold, depths = sentences
+	reporter = make_reporter(punctuation_masks, {'en': depths})
+
+	for conll_idx, sent_len in enumerate(lengths):
+		expected_predicted, expected_gold = baseline_directed_tree(
+			punctuation_masks[conll_idx], depths[conll_idx]['predicted'], depths[conll_idx]['gold'],
+			predicted[conll_idx][:sent_len, :sent_len].copy(), gold[conll_idx][:sent_len, :sent_len].copy(),
+			sent_len)
+		tree_predicted, tree_gold = reporter.tree('en', conll_idx, predicted[conll_idx], gold[conll_idx], sent_len)
+
+		assert unpack_edges(tree_predicted) == expected_predicted
+		assert unpack_edges(tree_gold) == expected_gold
+
+
+@pytest.mark.parametrize("sent_len", [1, 2, 7, 16])
+def test_removed_edges_kernels(sent_len):
+	pytest.importorskip('numba')
+	rng = np.random.RandomState(sent_len)
+	punctuation_mask = rng.rand(sent_len) < 0.3
+	# ties in depths are included, edges between equally deep words are removed
+	depths = rng.randint(0, 3, size=sent_len).astype(np.float32)
+
+	undirected = reporter_kernels.undirected_removed_edges(punctuation_mask)
+	directed = reporter_kernels.directed_removed_edges(punctuation_mask, depths)
+
+	punctuation_edges = punctuation_mask[:, None] | punctuation_mask[None, :]
+	assert undirected.dtype == bool and directed.dtype == bool
+	np.testing.assert_array_equal(undirected, punctuation_edges | np.tri(sent_len, sent_len, k=-1, dtype=bool))
+	np.testing.assert_array_equal(directed, punctuation_edges | (depths[:, None] <= depths[None, :]))
@@ -0,0 +1,116 @@
+import pytest
+import sys, os
+from types import SimpleNamespace
+
+import tensorflow as tf
+
+import numpy as np
+
+sys.path.append(os.path.abspath('../src'))
+from data_support.tfrecord_wrapper import merge_dict, TFRecordWriter
+
+
+def test_merge_dict_nested():
+	d1 = {'train': {'bert': {'en': {'dep_distance': None, 'dep_depth': 'a.tfrecord'}}}}
+	d2 = {'train': {'bert': {'en': {'dep_distance': 'b.tfrecord'}, 'es': {'dep_depth': 'c.tfrecord'}}},
+	      'dev': {'bert': None}}
+
+	merge_dict(d1, d2)
+
+	assert d1 == {'train': {'bert': {'en': {'dep_distance': 'b.tfrecord', 'dep_depth': 'a.tfrecord'},
+	                                 'es': {'dep_depth': 'c.tfrecord'}}},
+	              'dev': {'bert': None}}
+
+
+def test_merge_dict_overrides_non_dict():
+	d1 = {'tasks': {'dep_distance': None}, 'models': ['bert']}
+	d2 = {'tasks': None, 'models': ['roberta']}
+
+	merge_dict(d1, d2)
+
+	assert d1 == {'tasks': None, 'models': ['roberta']}
+
+
+class ToyModel:
+	""" Returns fixed hidden states (embedding output and layers) of shape [batch, wordpieces, emb_dim]."""
+	def __init__(self, hidden_states):
+		self.hidden_states = hidden_states
+
+	def __call__(self, wordpieces, attention_mask=None, training=False):
+		# states are cut to the shape of the input, so that smaller batches can be passed
+		batch_size, max_wordpieces = tf.shape(wordpieces)[0], tf.shape(wordpieces)[1]
+		return SimpleNamespace(hidden_states=tuple(hidden_state[:batch_size, :max_wordpieces]
+		                                           for hidden_state in self.hidden_states))
+
+
+@pytest.fixture
+def toy_batch():
+	rng = np.random.RandomState(0)
+	num_layers, emb_dim = 3, 4
+	# the second sentence is padded, special tokens and padding have segment -1
+	segments = np.array([[-1, 0, 0, 1, 2, 2, 2, -1],
+	                     [-1, 0, 1, 1, -1, -1, -1, -1]], dtype=np.int64)
+	token_len = [3, 2]
+	wordpieces = np.where(segments >= 0, 5, 0).astype(np.int64)
+	wordpieces[:, 0] = 1
+	wordpieces[0, -1] = 2
+	wordpieces[1, 4] = 2
+	hidden_states = tuple(tf.constant(rng.randn(*segments.shape, emb_dim), dtype=tf.float32)
+	                      for _ in range(num_layers + 1))
+	return ToyModel(hidden_states), wordpieces, segments, token_len
+
+
+def reference_embeddings(hidden_states, segments, token_len, layers):
+	""" Per sentence and layer segment mean, as computed before batching."""
+	embeddings = []
+	for sent_idx, sent_len in enumerate(token_len):
+		sent_embeddings = []
+		for layer in layers:
+			# the first hidden state is the output of embedding layer
+			layer_embeddings = tf.math.unsorted_segment_mean(hidden_states[layer + 1][sent_idx],
+			                                                 segments[sent_idx], sent_len).numpy()
+			sent_embeddings.append(layer_embeddings)
+		embeddings.append(np.stack(sent_embeddings))
+	return embeddings
+
+
+@pytest.mark.parametrize("layers", [None, [1]])
+def test_calc_embeddings_matches_segment_mean(toy_batch, layers):
+	model, wordpieces, segments, token_len = toy_batch
+	attention_mask = (wordpieces != 0).astype(np.int32)
+
+	embeddings = TFRecordWriter.calc_embeddings(model, tf.constant(wordpieces), tf.constant(attention_mask),
+	                                            tf.constant(segments), layers=layers).numpy()
+
+	layers = layers if layers is not None else list(range(len(model.hidden_states) - 1))
+	assert embeddings.shape == (len(token_len), len(layers), wordpieces.shape[1], model.hidden_states[0].shape[-1])
+	for sent_embeddings, sent_reference, sent_len in zip(embeddings,
+	                                                     reference_embeddings(model.hidden_states, segments,
+	                                                                          token_len, layers),
+	                                                     token_len):
+		np.testing.assert_allclose(sent_embeddings[:, :sent_len], sent_reference, rtol=1e-5, atol=1e-6)
+		# words beyond the sentence length are zero padding
+		assert not np.any(sent_embeddings[:, sent_len:])
+
+
+def test_embeddings_factory_dynamic_lengths(toy_batch):
+	model, wordpieces, segments, token_len = toy_batch
+	calc_embeddings = TFRecordWriter.embeddings_factory(model)
+	layers = list(range(len(model.hidden_states) - 1))
+
+	# the same traced function is used for a full batch and for a shorter batch with fewer wordpieces
+	for batch_size, max_wordpieces in ((2, 8), (1, 5)):
+		batch_wordpieces = wordpieces[:batch_size, :max_wordpieces]
+		batch_segments = segments[:batch_size, :max_wordpieces]
+		attention_mask = (batch_wordpieces != 0).astype(np.int32)
+		embeddings = calc_embeddings(tf.constant(batch_wordpieces), tf.constant(attention_mask),
+		                             tf.constant(batch_segments)).numpy()
+
+		assert embeddings.shape[:3] == (batch_size, len(layers), max_wordpieces)
+		hidden_states = model(tf.constant(batch_wordpieces)).hidden_states
+		for sent_embeddings, sent_reference, sent_len in zip(embeddings,
+		                                                     reference_embeddings(hidden_states, batch_segments,
+		                                                                          token_len[:batch_size], layers),
+		                                                     token_len):
+			np.testing.assert_allclose(sent_embeddings[:, :sent_len], sent_reference, rtol=1e-5, atol=1e-6)
+			assert not np.any(sent_embeddings[:, sent_len:])